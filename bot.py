@@ -222,15 +222,19 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Введите ваш вопрос, и я постараюсь вам помочь найти решение!")
 
 
-def main():
-    """Основная функция для запуска Telegram-бота."""
-    application = ApplicationBuilder().token(YOUR_TELEGRAM_BOT_TOKEN).build()
-
+def register_handlers(application):
+    """Регистрирует обработчики бота в приложении."""
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+
+def main():
+    """Основная функция для запуска Telegram-бота."""
+    application = ApplicationBuilder().token(YOUR_TELEGRAM_BOT_TOKEN).build()
+    register_handlers(application)
+
     logging.info("Бот запущен...")
     application.run_polling()
 
@@ -0,0 +1,532 @@
+"""Нагрузочный тест бота: прогоняет реальную цепочку обработчиков на N симулированных пользователях.
+
+Сценарий каждого пользователя: /start → ask_question → вопрос → clarify_question →
+уточнение → answer_received. OpenAI (эмбеддинги и чат) и Telegram подменяются
+локальными заглушками с настраиваемой задержкой, обработчики из bot.py не меняются.
+
+Пример запуска:
+    python load_test.py --users 20 --chat-latency 3 --embed-latency 0.3
+    python load_test.py --users 20 --chat my_stubs:RecordedChat  # своя заглушка ChatGPT
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+import numpy as np
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+
+import bot
+import chatgpt_handler
+from faiss_db import search
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+FAKE_TOKEN = "1:LOAD-TEST"
+USER_ID_OFFSET = 10_000
+
+SAMPLE_QUESTIONS = [
+    "Перегрев подшипников рольганга на стане горячей прокатки",
+    "Частые обрывы полосы при смотке",
+    "Повышенный износ футеровки ковша",
+    "Вибрация привода клети во время прокатки",
+    "Утечка воды в системе охлаждения кристаллизатора",
+]
+SAMPLE_CLARIFICATIONS = [
+    "А если замена смазки не помогла?",
+    "Какие меры можно принять без остановки агрегата?",
+    "Что делать, если проблема повторяется после ремонта?",
+]
+
+# Ответ-заглушка для режима --no-faiss
+FAKE_SEARCH_RECORDS = [
+    {
+        "distance": 0.1 * i,
+        "номер идеи": f"ИД-{i:04d}",
+        "статус": "Внедрена",
+        "название": f"Проблема {i}",
+        "описание": "Причина проблемы. " * 20,
+        "решение": "Описание решения. " * 40,
+    }
+    for i in range(10)
+]
+
+
+def percentile(values, pct):
+    """Возвращает перцентиль (по ближайшему рангу) для списка значений."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def current_rss_mb():
+    """Возвращает (RSS процесса в МБ, признак пикового значения), включая нативные аллокации FAISS.
+
+    Текущий RSS читается из /proc (Linux); на других POSIX-системах доступен только пиковый
+    ru_maxrss, а на Windows модуля resource нет — тогда возвращается (None, False).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, False
+    except (OSError, AttributeError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None, False
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в macOS измеряется в байтах, в остальных системах — в КБ
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max_rss / divisor, True
+
+
+def simulated_delay(latency, jitter):
+    """Возвращает случайную задержку вокруг latency с разбросом ±jitter (доля)."""
+    return max(0.0, latency * random.uniform(1 - jitter, 1 + jitter))
+
+
+class FakeEmbeddings:
+    """Заглушка OpenAIEmbeddings: блокирующий вызов с задержкой и детерминированным вектором."""
+
+    def __init__(self, latency=0.2, jitter=0.2, dimension=search.DIMENSION):
+        self.latency = latency
+        self.jitter = jitter
+        self.dimension = dimension
+
+    def embed_query(self, text):
+        # Клиент OpenAI синхронный, поэтому задержка тоже блокирующая (как в боте)
+        time.sleep(simulated_delay(self.latency, self.jitter))
+        seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).random(self.dimension, dtype=np.float32).tolist()
+
+
+class FakeChatCompletion:
+    """Заглушка openai.ChatCompletion.create: блокирующий вызов с задержкой и шаблонным ответом."""
+
+    def __init__(self, latency=2.0, jitter=0.2, answer_lines=15):
+        self.latency = latency
+        self.jitter = jitter
+        self.answer_lines = answer_lines
+
+    def create(self, model, messages, **kwargs):
+        time.sleep(simulated_delay(self.latency, self.jitter))
+        content = "1️⃣ **Есть ли информация по запросу?** **ДА**\n2️⃣ **Рекомендации по вопросу:**\n" + "\n".join(
+            f"- Рекомендация {i} по проблеме (идея: ИД-{i:04d}, Внедрена)" for i in range(self.answer_lines)
+        )
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"total_tokens": prompt_tokens + len(content) // 4},
+        }
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Транспорт Bot API без сети: отвечает на методы локально и запоминает исходящие сообщения."""
+
+    def __init__(self, latency=0.05, jitter=0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.sent = {}  # chat_id -> список отправленных сообщений
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        await asyncio.sleep(simulated_delay(self.latency, self.jitter))
+
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            self.sent.setdefault(chat_id, []).append(params)
+        else:
+            # answerCallbackQuery, deleteMessage и прочие методы просто подтверждаем
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class UpdateFactory:
+    """Строит объекты Update в том виде, в каком их присылает Telegram."""
+
+    def __init__(self, telegram_bot):
+        self.bot = telegram_bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Оператор {user_id}"}
+
+    def message(self, user_id, text):
+        data = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": next(self._update_ids), "message": data}, self.bot)
+
+    def callback(self, user_id, callback_data):
+        update_id = next(self._update_ids)
+        data = {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": callback_data,
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "...",
+            },
+        }
+        return Update.de_json({"update_id": update_id, "callback_query": data}, self.bot)
+
+
+class LoadTest:
+    """Запускает сценарии пользователей и собирает метрики."""
+
+    def __init__(self, args):
+        self.args = args
+        self.transport = FakeTelegramRequest(args.telegram_latency, args.jitter)
+        self.application = (
+            ApplicationBuilder()
+            .token(FAKE_TOKEN)
+            .request(self.transport)
+            .get_updates_request(FakeTelegramRequest(args.telegram_latency, args.jitter))
+            .updater(None)
+            .concurrent_updates(args.concurrent_updates)
+            .build()
+        )
+        bot.register_handlers(self.application)
+        self.factory = UpdateFactory(self.application.bot)
+        self.results = []  # по одной записи на обработанный Update
+        self.memory_samples = []
+        self.flow_errors = 0
+        self.completed_sessions = 0  # сессии, в которых оба вопроса получили ответ с кнопками
+        self._stop_sampling = threading.Event()
+
+    async def dispatch(self, step, update, scheduled):
+        """Проводит Update через тот же процессор очереди, что и Application при polling.
+
+        Задержки считаются от scheduled — момента, когда пользователь отправил бы Update.
+        Пока заглушка блокирует цикл событий, корутина пользователя не может проснуться,
+        и время от loop.time() на входе не учло бы это ожидание.
+        """
+        loop = asyncio.get_running_loop()
+        started = None
+
+        async def timed_process():
+            nonlocal started
+            started = loop.time()
+            await self.application.process_update(update)
+
+        await self.application.update_processor.process_update(update, timed_process())
+        finished = loop.time()
+        result = {
+            "step": step,
+            "scheduled": scheduled - self.started_at,
+            "queue_delay": started - scheduled,
+            "latency": finished - scheduled,
+            "ok": True,
+        }
+        self.results.append(result)
+        return result
+
+    async def run_user(self, index):
+        """Сценарий одного пользователя от /start до «Ответ получен»."""
+        args = self.args
+        loop = asyncio.get_running_loop()
+        user_id = USER_ID_OFFSET + index
+        scheduled = self.started_at + args.ramp_up * index / max(args.users, 1)
+        await asyncio.sleep(scheduled - loop.time())
+
+        for session in range(args.sessions):
+            last_session = session == args.sessions - 1
+            question = SAMPLE_QUESTIONS[(index + session) % len(SAMPLE_QUESTIONS)]
+            clarification = SAMPLE_CLARIFICATIONS[(index + session) % len(SAMPLE_CLARIFICATIONS)]
+            steps = [
+                ("start", self.factory.message(user_id, "/start"), False),
+                ("ask_question", self.factory.callback(user_id, "ask_question"), False),
+                ("question", self.factory.message(user_id, question), True),
+                ("clarify_question", self.factory.callback(user_id, "clarify_question"), False),
+                ("clarification", self.factory.message(user_id, clarification), True),
+                ("answer_received", self.factory.callback(user_id, "answer_received"), False),
+            ]
+            session_ok = True
+            for position, (step, update, expects_answer) in enumerate(steps):
+                sent_before = len(self.transport.sent.get(user_id, []))
+                result = await self.dispatch(step, update, scheduled)
+                if expects_answer and not self._got_answer(user_id, sent_before):
+                    # Бот ответил не ответом с кнопками (например, из-за общего состояния WAITING_*)
+                    result["ok"] = False
+                    self.flow_errors += 1
+                    session_ok = False
+                if position == len(steps) - 1 and session_ok:
+                    self.completed_sessions += 1
+                if last_session and position == len(steps) - 1:
+                    break  # после последнего шага не ждём, чтобы не растягивать длительность прогона
+                # Момент следующей отправки фиксируем до сна, чтобы не потерять время блокировки цикла
+                think_time = simulated_delay(args.think_time, args.jitter)
+                scheduled = loop.time() + think_time
+                await asyncio.sleep(think_time)
+
+    def _got_answer(self, user_id, sent_before):
+        """Проверяет, что после шага пользователю пришёл ответ с кнопкой «Ответ получен»."""
+        for params in self.transport.sent.get(user_id, [])[sent_before:]:
+            if "answer_received" in json.dumps(params.get("reply_markup", {})):
+                return True
+        return False
+
+    def sample_memory(self):
+        """Периодически снимает объём памяти и размер USER_CONTEXT.
+
+        Работает в отдельном потоке: заглушки блокируют цикл событий, и задача asyncio
+        не смогла бы соблюдать интервал замеров.
+        """
+        while True:
+            rss_mb, rss_is_peak = current_rss_mb()
+            sample = {
+                "time": time.monotonic() - self.sampler_started_at,
+                "rss_mb": rss_mb,
+                "rss_is_peak": rss_is_peak,
+                "user_context": len(bot.USER_CONTEXT),
+                "done_updates": len(self.results),
+            }
+            if self.args.tracemalloc:
+                current, peak = tracemalloc.get_traced_memory()
+                sample["current_mb"] = current / 1024 / 1024
+                sample["peak_mb"] = peak / 1024 / 1024
+            self.memory_samples.append(sample)
+            if self._stop_sampling.wait(self.args.sample_interval):
+                return
+
+    async def run(self):
+        """Инициализирует приложение, запускает пользователей и возвращает длительность прогона."""
+        await self.application.initialize()
+        gc.collect()
+        if self.args.tracemalloc:
+            # tracemalloc замедляет каждую аллокацию, поэтому включается только по флагу
+            tracemalloc.start()
+        loop = asyncio.get_running_loop()
+        self.started_at = loop.time()
+        # Поток замеров не может опираться на часы цикла событий, у него свой отсчёт
+        self.sampler_started_at = time.monotonic()
+        sampler = threading.Thread(target=self.sample_memory, name="memory-sampler", daemon=True)
+        sampler.start()
+        try:
+            await asyncio.gather(*(self.run_user(i) for i in range(self.args.users)))
+        finally:
+            duration = loop.time() - self.started_at
+            self._stop_sampling.set()
+            sampler.join()
+            await self.application.shutdown()
+            if self.args.tracemalloc:
+                tracemalloc.stop()
+        return duration
+
+
+def fake_search_problem(query):
+    """Заменяет search_problem без FAISS-индекса: эмбеддинг-заглушка + фиксированные записи."""
+    search.embed_query(query)
+    return json.dumps({"проблемы": FAKE_SEARCH_RECORDS}, ensure_ascii=False, indent=4)
+
+
+def load_factory(path):
+    """Импортирует фабрику заглушки по пути вида «модуль:имя» (для --embeddings и --chat)."""
+    module_name, _, attr = path.partition(":")
+    if not module_name or not attr:
+        raise argparse.ArgumentTypeError(f"ожидается путь вида модуль:имя, получено {path!r}")
+    try:
+        return getattr(importlib.import_module(module_name), attr)
+    except (ImportError, AttributeError) as e:
+        raise argparse.ArgumentTypeError(f"не удалось загрузить {path!r}: {e}")
+
+
+def install_stubs(args, embeddings=None, chat_completion=None):
+    """Подменяет внешние сервисы заглушками; можно передать свои реализации.
+
+    Без явно переданных объектов заглушки создаются фабриками из --embeddings и --chat
+    (по умолчанию FakeEmbeddings и FakeChatCompletion), которые вызываются как factory(latency, jitter).
+    """
+    embeddings_factory = args.embeddings or FakeEmbeddings
+    chat_factory = args.chat or FakeChatCompletion
+    embeddings = embeddings or embeddings_factory(args.embed_latency, args.jitter)
+    chat_completion = chat_completion or chat_factory(args.chat_latency, args.jitter)
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(search, "embeddings", embeddings))
+        stack.enter_context(mock.patch.object(chatgpt_handler.openai.ChatCompletion, "create", chat_completion.create))
+        if args.no_faiss or not os.path.exists(search.FAISS_INDEX_PATH):
+            stack.enter_context(mock.patch.object(bot, "search_problem", fake_search_problem))
+        if not args.verbose:
+            # generate_final_response печатает весь найденный JSON на каждый запрос
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        # Если что-то выше упало, with снимет уже установленные подмены
+        return stack.pop_all()
+
+
+def print_report(test, duration):
+    """Выводит сводку по прогону; задержки и пропускная способность — только по успешным шагам."""
+    results = [r for r in test.results if r["ok"]]
+    latencies = [r["latency"] for r in results]
+    queue_delays = [r["queue_delay"] for r in results]
+
+    print("\n📊 Итоги нагрузочного теста")
+    print(f"Пользователей: {test.args.users}, сессий на пользователя: {test.args.sessions}, "
+          f"concurrent_updates: {test.args.concurrent_updates}")
+    print(f"Длительность: {duration:.2f} с, обработано Update: {len(test.results)} "
+          f"(успешно {len(results)}), вызовов Bot API: {test.transport.calls}")
+    print(f"Пропускная способность (успешные): {len(results) / duration:.2f} update/с, "
+          f"{test.completed_sessions / duration * 60:.2f} сессий/мин "
+          f"({test.completed_sessions} из {test.args.users * test.args.sessions} сессий завершены)")
+    print(f"Сбои сценария (нет ответа с кнопками): {test.flow_errors}")
+
+    header = f"{'шаг':<18}{'успешно':>8}{'сбоев':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'очередь p50':>13}{'очередь p95':>13}"
+    print("\n⏱ Задержка успешных шагов, с (от постановки в очередь, т.е. запланированной отправки, до завершения обработчика)")
+    print(header)
+    steps = ["start", "ask_question", "question", "clarify_question", "clarification", "answer_received"]
+    for step in steps + ["всего"]:
+        rows = results if step == "всего" else [r for r in results if r["step"] == step]
+        failed = sum(1 for r in test.results if not r["ok"] and step in ("всего", r["step"]))
+        step_latencies = [r["latency"] for r in rows]
+        step_delays = [r["queue_delay"] for r in rows]
+        print(f"{step:<18}{len(rows):>8}{failed:>7}"
+              f"{percentile(step_latencies, 50):>9.3f}{percentile(step_latencies, 95):>9.3f}"
+              f"{percentile(step_latencies, 99):>9.3f}"
+              f"{percentile(step_delays, 50):>13.3f}{percentile(step_delays, 95):>13.3f}")
+
+    print(f"\nОжидание в очереди: среднее {sum(queue_delays) / max(len(queue_delays), 1):.3f} с, "
+          f"максимум {max(queue_delays, default=0):.3f} с; "
+          f"максимальная задержка {max(latencies, default=0):.3f} с")
+
+    rss_is_peak = any(sample["rss_is_peak"] for sample in test.memory_samples)
+    rss_title = "пик RSS, МБ" if rss_is_peak else "RSS, МБ"
+    with_tracemalloc = test.args.tracemalloc
+    print("\n🧠 Память (RSS процесса" + (" и Python-куча по tracemalloc)" if with_tracemalloc else ")"))
+    print(f"{'время, с':>10}{rss_title:>13}"
+          + (f"{'tracemalloc, МБ':>17}{'пик, МБ':>10}" if with_tracemalloc else "")
+          + f"{'USER_CONTEXT':>14}{'update':>9}")
+    for sample in test.memory_samples:
+        rss = "н/д" if sample["rss_mb"] is None else f"{sample['rss_mb']:.2f}"
+        print(f"{sample['time']:>10.1f}{rss:>13}"
+              + (f"{sample['current_mb']:>17.2f}{sample['peak_mb']:>10.2f}" if with_tracemalloc else "")
+              + f"{sample['user_context']:>14}{sample['done_updates']:>9}")
+    if test.memory_samples:
+        first, last = test.memory_samples[0], test.memory_samples[-1]
+        if last["rss_mb"] is None:
+            growth = ["RSS н/д на этой платформе"]
+        else:
+            growth = [f"{rss_title.split(',')[0]} {last['rss_mb'] - first['rss_mb']:+.2f} МБ"]
+        if with_tracemalloc:
+            growth.append(f"tracemalloc {last['current_mb'] - first['current_mb']:+.2f} МБ")
+        print(f"Прирост памяти за прогон: {', '.join(growth)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Telegram-бота с заглушками OpenAI и Telegram.")
+    parser.add_argument("--users", type=int, default=10, help="количество одновременных пользователей")
+    parser.add_argument("--sessions", type=int, default=1, help="сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--concurrent-updates", type=int, default=1,
+                        help="параллельно обрабатываемых Update (1 — как в bot.main)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="время подключения всех пользователей, с")
+    parser.add_argument("--think-time", type=float, default=0.5, help="пауза пользователя между шагами, с")
+    parser.add_argument("--embed-latency", type=float, default=0.2, help="задержка эмбеддинга, с")
+    parser.add_argument("--chat-latency", type=float, default=2.0, help="задержка ответа ChatGPT, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка вызова Bot API, с")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержек (доля от значения)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="интервал замера памяти, с")
+    parser.add_argument("--embeddings", type=load_factory,
+                        help="своя заглушка эмбеддингов: модуль:фабрика, вызывается как фабрика(latency, jitter) "
+                             "и возвращает объект с методом embed_query(text)")
+    parser.add_argument("--chat", type=load_factory,
+                        help="своя заглушка ChatGPT: модуль:фабрика, вызывается как фабрика(latency, jitter) "
+                             "и возвращает объект с методом create(model, messages, **kwargs)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="дополнительно замерять Python-кучу через tracemalloc (замедляет обработчики)")
+    parser.add_argument("--no-faiss", action="store_true", help="не использовать FAISS-индекс, вернуть фиксированные записи")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора задержек")
+    parser.add_argument("--json", dest="json_path", help="сохранить сырые результаты в JSON-файл")
+    parser.add_argument("--verbose", action="store_true", help="оставить логи и print обработчиков")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    test = LoadTest(args)
+    with install_stubs(args):
+        duration = asyncio.run(test.run())
+
+    print_report(test, duration)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "args": vars(args),
+                "duration": duration,
+                "flow_errors": test.flow_errors,
+                "completed_sessions": test.completed_sessions,
+                "updates": test.results,
+                "memory": test.memory_samples,
+            }, f, ensure_ascii=False, indent=4)
+        print(f"\n💾 Результаты сохранены в {args.json_path}")
+
+    if test.flow_errors:
+        print(f"\n⚠️ {test.flow_errors} вопросов не получили ответа: обработчик вернулся раньше, не вызвав "
+              "поиск и ChatGPT (общие флаги WAITING_* в bot.py перезаписываются другими пользователями). "
+              "Цифры выше не отражают одновременную нагрузку на LLM.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))